@@ -0,0 +1,120 @@
+import hashlib
+from shapely import wkt
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+# Tolerância (graus) para considerar duas AOIs a mesma área: ~550 m no
+# equador, cerca de um pixel MODIS de 500 m. Cobre cópias da mesma AOI
+# geradas com centros ligeiramente diferentes (ex: os dois buffers de ATTO,
+# deslocados ~0,004°, e os de K67, ~0,0001°).
+DUPLICATE_TOLERANCE_DEG = 0.005
+
+
+def geometry_hash(shape, precision=7):
+    """
+    Gera um hash estável para uma geometria (EPSG:4326).
+    A geometria é normalizada e as coordenadas arredondadas, de modo que
+    shapefiles com a mesma forma (ex: cópias renomeadas) gerem o mesmo hash.
+    """
+    normalized = shape.normalize()
+    text = wkt.dumps(normalized, rounding_precision=precision)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def is_duplicate(a, b, tolerance=DUPLICATE_TOLERANCE_DEG):
+    """
+    True se as duas geometrias representam a mesma AOI: hash idêntico ou
+    nenhum ponto de uma está a mais de 'tolerance' graus da outra (Hausdorff).
+    """
+    if geometry_hash(a) == geometry_hash(b):
+        return True
+    return a.hausdorff_distance(b) <= tolerance
+
+
+def _bbox_area(shape):
+    """Área do retângulo envolvente, que é o que o GEE realmente exporta."""
+    return box(*shape.bounds).area
+
+
+def _overlaps(a, b):
+    """True se as geometrias compartilham área (tocar apenas na borda não conta)."""
+    return a.intersects(b) and not a.touches(b)
+
+
+def group_aois(aoi_shapes):
+    """
+    Agrupa AOIs idênticas ou sobrepostas para que cada pixel seja baixado uma só vez.
+
+    Recebe um dicionário {nome_aoi: geometria_shapely} e retorna uma lista de
+    grupos no formato:
+        {'name': str, 'footprint': geometria, 'members': {nome_aoi: geometria},
+         'aliases': {nome_aoi: [nomes das cópias idênticas]}}
+
+    - AOIs com geometria idêntica (mesmo hash) viram 'aliases' de um único
+      membro: média e recorte são feitos uma vez e copiados para as cópias.
+    - AOIs quase idênticas (diferença menor que DUPLICATE_TOLERANCE_DEG)
+      caem sempre no mesmo grupo como membros distintos; o footprint é a união.
+    - AOIs sobrepostas são unidas quando o retângulo do footprint unido não é
+      maior que a soma dos retângulos separados (caso contrário, baixar a união
+      custaria mais pixels do que baixar cada uma).
+    Grupos com um único membro são processados normalmente, sem recorte local.
+    """
+    # --- 1. Geometrias idênticas: processadas uma vez, copiadas para as cópias ---
+    unique_shapes = {}
+    aliases = {}
+    primary_by_hash = {}
+    for aoi_name, shape in aoi_shapes.items():
+        key = geometry_hash(shape)
+        if key in primary_by_hash:
+            aliases.setdefault(primary_by_hash[key], []).append(aoi_name)
+        else:
+            primary_by_hash[key] = aoi_name
+            unique_shapes[aoi_name] = shape
+
+    # --- 2. Agrupar geometrias quase idênticas ---
+    clusters = []
+    for aoi_name, shape in unique_shapes.items():
+        for cluster in clusters:
+            if any(is_duplicate(shape, other) for other in cluster['members'].values()):
+                cluster['footprint'] = unary_union([cluster['footprint'], shape])
+                cluster['members'][aoi_name] = shape
+                break
+        else:
+            clusters.append({'footprint': shape, 'members': {aoi_name: shape}})
+
+    # --- 3. Unir clusters sobrepostos enquanto isso reduzir o custo ---
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(clusters)):
+            for j in range(i + 1, len(clusters)):
+                a = clusters[i]['footprint']
+                b = clusters[j]['footprint']
+                if not _overlaps(a, b):
+                    continue
+                union = unary_union([a, b])
+                if _bbox_area(union) > _bbox_area(a) + _bbox_area(b):
+                    continue
+                clusters[i]['footprint'] = union
+                clusters[i]['members'].update(clusters[j]['members'])
+                del clusters[j]
+                merged = True
+                break
+            if merged:
+                break
+
+    # --- 4. Nomear os grupos ---
+    groups = []
+    for cluster in clusters:
+        members = cluster['members']
+        if len(members) == 1:
+            name = next(iter(members))
+        else:
+            name = f"grupo_{geometry_hash(cluster['footprint'])[:10]}"
+        groups.append({
+            'name': name,
+            'footprint': cluster['footprint'],
+            'members': members,
+            'aliases': {name: aliases[name] for name in members if name in aliases},
+        })
+    return groups
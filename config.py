@@ -17,8 +17,16 @@ RAW_TIF_DIR = os.path.join(DATA_DIR, 'raw_tifs')
 # Subpasta para os CSVs com as médias
 CSV_DIR = os.path.join(DATA_DIR, 'csv_means')
 
+# Subpasta para as séries temporais por ponto/torre (modo de séries por local)
+SITES_DIR = os.path.join(DATA_DIR, 'site_series')
+
+# Subpasta para os TIFs compartilhados (footprint de AOIs duplicadas/sobrepostas)
+SHARED_TIF_DIR = os.path.join(DATA_DIR, 'shared_tifs')
+
 # --- Funções para garantir que as pastas existam ---
 def setup_directories():
     """Cria todas as pastas de saída necessárias se não existirem."""
     os.makedirs(RAW_TIF_DIR, exist_ok=True)
-    os.makedirs(CSV_DIR, exist_ok=True)
\ No newline at end of file
+    os.makedirs(CSV_DIR, exist_ok=True)
+    os.makedirs(SHARED_TIF_DIR, exist_ok=True)
+    os.makedirs(SITES_DIR, exist_ok=True)
\ No newline at end of file
@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import setup_directories
+from utils import find_shapefiles
+from aoi_groups import group_aois
+from planner import plan_job
+from gee_ops import authenticate_gee, load_aoi_shape, site_table_prefix, MODIS_COLLECTIONS, MAX_WINDOW_PIXELS
+from download_tool import run_downloads, run_site_extraction
+
+# === ESTADO COMPARTILHADO DO DAEMON ===
+# Tudo aqui fica "quente" entre jobs: sessão do GEE, geometrias e fila.
+
+# Cache de geometrias das AOIs: {caminho: (mtime, geometria_shapely)}
+_aoi_cache = {}
+_aoi_cache_lock = threading.Lock()
+
+# Fila de jobs e registro de status: {id: dicionário_do_job}
+_job_queue = queue.Queue()
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+# Um lock por saída (AOI ou tabela de locais, coleção): jobs que escrevem nos
+# mesmos arquivos (temporários, TIFs e CSVs) rodam um de cada vez; os demais
+# seguem em paralelo
+_output_locks = {}
+_output_locks_lock = threading.Lock()
+
+
+def _load_aoi_cached(shapefile_path):
+    """Carrega a geometria da AOI uma única vez (recarrega se o arquivo mudar)."""
+    mtime = os.path.getmtime(shapefile_path)
+    with _aoi_cache_lock:
+        cached = _aoi_cache.get(shapefile_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    shape = load_aoi_shape(shapefile_path)
+    with _aoi_cache_lock:
+        _aoi_cache[shapefile_path] = (mtime, shape)
+    return shape
+
+
+def _require_str_list(params, field):
+    """Retorna params[field] se for uma lista não vazia de strings; senão lança ValueError."""
+    values = params.get(field, [])
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise ValueError(f"'{field}' deve ser uma lista de strings.")
+    return values
+
+
+def _parse_job(params):
+    """
+    Valida o JSON de um job e retorna (geometrias_das_aois, parâmetros normalizados).
+    Lança ValueError com uma mensagem amigável se algo estiver errado, inclusive
+    se o shapefile de uma AOI não puder ser lido.
+    """
+    if not isinstance(params, dict):
+        raise ValueError("O corpo da requisição deve ser um objeto JSON.")
+
+    shapefiles = {os.path.splitext(os.path.basename(shp))[0]: shp for shp in find_shapefiles()}
+
+    aoi_names = [os.path.splitext(name)[0] for name in _require_str_list(params, 'aois')]
+    if not aoi_names:
+        raise ValueError("Informe ao menos uma AOI em 'aois'.")
+    unknown = [name for name in aoi_names if name not in shapefiles]
+    if unknown:
+        raise ValueError(f"AOIs não encontradas em aoi/: {', '.join(unknown)}")
+
+    collections = _require_str_list(params, 'collections')
+    if not collections:
+        raise ValueError("Informe ao menos uma coleção em 'collections'.")
+    unknown = [key for key in collections if key not in MODIS_COLLECTIONS]
+    if unknown:
+        raise ValueError(f"Coleções desconhecidas: {', '.join(unknown)}")
+
+    start_date = params.get('start_date', '2001-01-01')
+    end_date = params.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+    for date_str in (start_date, end_date):
+        if not isinstance(date_str, str):
+            raise ValueError("'start_date' e 'end_date' devem ser strings AAAA-MM-DD.")
+        try:
+            datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f"Data inválida '{date_str}'. Use AAAA-MM-DD")
+
+    mode = params.get('mode', 'rasters')
+    if mode not in ('rasters', 'sites'):
+        raise ValueError("'mode' deve ser 'rasters' ou 'sites'.")
+
+    # bool é subclasse de int em Python; rejeitamos true/false aqui
+    window_pixels = params.get('window_pixels', 0)
+    if (not isinstance(window_pixels, int) or isinstance(window_pixels, bool)
+            or not 0 <= window_pixels <= MAX_WINDOW_PIXELS):
+        raise ValueError(f"'window_pixels' deve ser um número inteiro de 0 a {MAX_WINDOW_PIXELS}.")
+
+    # Apenas booleanos JSON: "false" (string) não pode virar True
+    native_grid = params.get('native_grid', False)
+    if not isinstance(native_grid, bool):
+        raise ValueError("'native_grid' deve ser true ou false (booleano JSON).")
+
+    aoi_shapes = {}
+    for name in aoi_names:
+        # Shapefile removido ou ilegível (arquivos auxiliares faltando, CRS inválido...)
+        try:
+            aoi_shapes[name] = _load_aoi_cached(shapefiles[name])
+        except Exception as e:
+            raise ValueError(f"Erro ao carregar a AOI '{name}': {e}")
+    job = {
+        'mode': mode,
+        'aois': aoi_names,
+        'collections': collections,
+        'start_date': start_date,
+        'end_date': end_date,
+        'native_grid': native_grid,
+        'window_pixels': window_pixels,
+    }
+    return aoi_shapes, job
+
+
+def _job_sites(aoi_shapes):
+    """Locais do modo 'sites': os centroides das AOIs do job."""
+    return {name: (shape.centroid.x, shape.centroid.y) for name, shape in aoi_shapes.items()}
+
+
+def _job_output_keys(job, aoi_shapes):
+    """Chaves das saídas que um job escreve, em ordem fixa (evita deadlock)."""
+    if job['mode'] == 'sites':
+        # Mesmo prefixo das tabelas em SITES_DIR: só conflita quem escreveria o mesmo arquivo
+        sites = _job_sites(aoi_shapes)
+        return sorted(
+            ('__sites__', site_table_prefix(sites, key, job['start_date'], job['end_date'],
+                                            window_pixels=job['window_pixels'],
+                                            native_grid=job['native_grid']))
+            for key in job['collections']
+        )
+    return sorted((aoi, key) for aoi in job['aois'] for key in job['collections'])
+
+
+def _acquire_outputs(keys):
+    """Obtém (bloqueando) os locks de todas as saídas do job e retorna a lista."""
+    with _output_locks_lock:
+        locks = [_output_locks.setdefault(key, threading.Lock()) for key in keys]
+    for lock in locks:
+        lock.acquire()
+    return locks
+
+
+def _worker():
+    """Consome a fila de jobs; vários workers formam o pool compartilhado."""
+    while True:
+        job_id, aoi_shapes = _job_queue.get()
+        with _jobs_lock:
+            job = _jobs[job_id]
+            job['status'] = 'waiting'
+        locks = _acquire_outputs(_job_output_keys(job, aoi_shapes))
+        with _jobs_lock:
+            job['status'] = 'running'
+            job['started'] = datetime.now().isoformat(timespec='seconds')
+        try:
+            if job['mode'] == 'sites':
+                # Séries por local: usa os centroides das AOIs
+                errors = run_site_extraction(_job_sites(aoi_shapes), job['collections'], job['start_date'],
+                                             job['end_date'], window_pixels=job['window_pixels'],
+                                             native_grid=job['native_grid'])
+            else:
+                aoi_groups = group_aois(aoi_shapes)
+                plan = plan_job(aoi_groups, job['collections'], job['start_date'],
+                                job['end_date'], native_grid=job['native_grid'])
+                strategies = {(item['group'], item['collection']): item['strategy'] for item in plan}
+                errors = run_downloads(aoi_groups, job['collections'], job['start_date'],
+                                       job['end_date'], strategies, native_grid=job['native_grid'])
+            status = 'done_with_errors' if errors else 'done'
+        except Exception as e:
+            errors = [str(e)]
+            status = 'failed'
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        with _jobs_lock:
+            job['status'] = status
+            job['errors'] = errors
+            job['finished'] = datetime.now().isoformat(timespec='seconds')
+        _job_queue.task_done()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    API local de jobs:
+      GET  /health      -> estado do daemon
+      GET  /jobs        -> lista de jobs
+      GET  /jobs/<id>   -> status de um job
+      POST /plan        -> plano de execução (dry-run), sem enfileirar
+      POST /jobs        -> enfileira um job
+    """
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def address_string(self):
+        # Em sockets Unix o client_address é vazio
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'queued': _job_queue.qsize()})
+        elif self.path == '/jobs':
+            with _jobs_lock:
+                self._send_json(200, list(_jobs.values()))
+        elif self.path.startswith('/jobs/'):
+            job_id = self.path[len('/jobs/'):]
+            with _jobs_lock:
+                job = _jobs.get(job_id)
+                if job is None:
+                    self._send_json(404, {'error': f"Job '{job_id}' não encontrado."})
+                else:
+                    self._send_json(200, job)
+        else:
+            self._send_json(404, {'error': 'Rota não encontrada.'})
+
+    def do_POST(self):
+        if self.path not in ('/jobs', '/plan'):
+            self._send_json(404, {'error': 'Rota não encontrada.'})
+            return
+        try:
+            aoi_shapes, job = _parse_job(self._read_json())
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': f"Erro interno ao validar o job: {e}"})
+            return
+
+        if self.path == '/plan':
+            try:
+                plan = plan_job(group_aois(aoi_shapes), job['collections'],
+                                job['start_date'], job['end_date'],
+                                native_grid=job['native_grid'])
+            except Exception as e:
+                self._send_json(500, {'error': f"Erro ao montar o plano: {e}"})
+                return
+            self._send_json(200, plan)
+            return
+
+        job_id = uuid.uuid4().hex[:12]
+        job.update({
+            'id': job_id,
+            'status': 'queued',
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'errors': [],
+        })
+        with _jobs_lock:
+            _jobs[job_id] = job
+        _job_queue.put((job_id, aoi_shapes))
+        self._send_json(202, job)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Servidor HTTP em socket Unix (sem porta TCP aberta)."""
+    daemon_threads = True
+
+
+def main():
+    """Inicia o daemon: autentica uma vez, sobe o pool de workers e a API local."""
+    parser = argparse.ArgumentParser(description="Daemon de downloads MODIS GEE")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="Caminho de um socket Unix (substitui host/porta)")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="Quantos jobs rodam em paralelo")
+    args = parser.parse_args()
+
+    print("=============================================")
+    print("  Daemon de Download de Dados MODIS GEE      ")
+    print("=============================================")
+
+    # --- 1. Setup único: pastas, sessão do GEE e geometrias ---
+    setup_directories()
+    authenticate_gee()
+    for shp in find_shapefiles():
+        try:
+            _load_aoi_cached(shp)
+        except Exception as e:
+            print(f"Erro ao pré-carregar {os.path.basename(shp)}: {e}")
+
+    # --- 2. Pool de workers ---
+    for _ in range(max(1, args.workers)):
+        threading.Thread(target=_worker, daemon=True).start()
+
+    # --- 3. API local ---
+    if args.socket:
+        if not hasattr(socket, 'AF_UNIX'):
+            print("Sockets Unix não são suportados neste sistema. Use --port.")
+            sys.exit(1)
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, JobRequestHandler)
+        print(f"Aguardando jobs em unix:{args.socket} ({args.workers} workers)")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), JobRequestHandler)
+        print(f"Aguardando jobs em http://{args.host}:{args.port} ({args.workers} workers)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nEncerrando o daemon.")
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
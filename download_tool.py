@@ -3,18 +3,183 @@ import sys
 import os
 from datetime import datetime
 from tqdm import tqdm
-from config import RAW_TIF_DIR, CSV_DIR
+from config import RAW_TIF_DIR, CSV_DIR, SITES_DIR
 from config import setup_directories
-from utils import find_shapefiles
+from utils import find_shapefiles, load_sites_csv
+from aoi_groups import group_aois
+from planner import plan_job, print_plan
 from gee_ops import (
     authenticate_gee, 
-    get_aoi_geometry, 
+    load_aoi_shape, 
+    shape_to_ee_geometry, 
     process_collection, 
-    MODIS_COLLECTIONS
+    extract_site_series, 
+    MODIS_COLLECTIONS,
+    MAX_WINDOW_PIXELS
 )
 
+# Modos de execução oferecidos na CLI
+MODE_RASTERS = "Download de rasters (GeoTIFF por data + CSV de médias)"
+MODE_SITES = "Séries temporais por local/torre (amostragem em lote, sem rasters)"
+
+def run_downloads(aoi_groups, collection_keys, start_date, end_date, strategies,
+                  native_grid=False):
+    """
+    Executa os downloads para todos os grupos de AOI e coleções, usando a
+    estratégia escolhida pelo planner para cada par (grupo, coleção).
+    Retorna a lista de erros encontrados (vazia se tudo deu certo).
+    """
+    errors = []
+    for group in aoi_groups:
+        group_name = group['name']
+        # Grupos com mais de uma AOI baixam o footprint e recortam localmente
+        clip_targets = group['members'] if len(group['members']) > 1 else None
+        aliases = group.get('aliases') or None
+
+        print(f"\n\n=======================================================")
+        print(f"   Iniciando processamento para a AOI: {group_name} ")
+        if clip_targets:
+            print(f"   (AOIs do grupo: {', '.join(clip_targets)})")
+        for primary, copies in (aliases or {}).items():
+            print(f"   ({', '.join(copies)}: cópia idêntica de {primary}, resultados copiados)")
+        print(f"=======================================================")
+        
+        # --- Converter a geometria para esta AOI/grupo ---
+        aoi_geom = shape_to_ee_geometry(group['footprint'])
+        if aoi_geom is None:
+            print(f"Erro ao carregar geometria para {group_name}. Pulando esta AOI.")
+            errors.append(f"{group_name}: geometria não suportada")
+            continue 
+
+        # *** INÍCIO DA MUDANÇA: Adicionar barra de progresso TQDM ***
+        # Esta barra mostra o progresso das *coleções* para a AOI atual
+        collection_progressbar = tqdm(collection_keys, 
+                                      desc=f"Progresso (AOI: {group_name})", 
+                                      unit="coleção")
+        
+        for collection_key in collection_progressbar:
+            # Atualiza a descrição da barra para a coleção atual
+            collection_progressbar.set_postfix_str(collection_key)
+            
+            strategy = strategies[(group_name, collection_key)]
+            try:
+                process_collection(group_name, collection_key, aoi_geom, start_date, end_date,
+                                   clip_targets=clip_targets,
+                                   aliases=aliases,
+                                   workers=strategy['workers'],
+                                   batched_means=strategy['batched_means'],
+                                   tile_grid=strategy['tile_grid'],
+                                   native_grid=native_grid)
+            except Exception as e:
+                # Se algo der errado, registra e continua
+                tqdm.write(f"*** ERRO GERAL ao processar {collection_key} para {group_name}: {e}")
+                errors.append(f"{group_name}/{collection_key}: {e}")
+                tqdm.write("   Pulando para a próxima coleção...")
+        # *** FIM DA MUDANÇA ***
+        
+        print(f"\n--- Processamento da AOI {group_name} concluído ---")
+
+    return errors
+
+
+def run_site_extraction(sites, collection_keys, start_date, end_date,
+                        window_pixels=0, native_grid=False):
+    """
+    Extrai as séries temporais de todos os locais para cada coleção (sampleRegions em lote).
+    Retorna a lista de erros encontrados (vazia se tudo deu certo).
+    """
+    errors = []
+    collection_progressbar = tqdm(collection_keys, 
+                                  desc=f"Progresso ({len(sites)} locais)", 
+                                  unit="coleção")
+    for collection_key in collection_progressbar:
+        collection_progressbar.set_postfix_str(collection_key)
+        try:
+            extract_site_series(sites, collection_key, start_date, end_date,
+                                window_pixels=window_pixels, native_grid=native_grid)
+        except Exception as e:
+            tqdm.write(f"*** ERRO GERAL ao extrair {collection_key}: {e}")
+            errors.append(f"{collection_key}: {e}")
+            tqdm.write("   Pulando para a próxima coleção...")
+    return errors
+
+
+def run_sites_mode(shapefiles, selected_aoi_basenames, selected_collections,
+                   start_date, end_date, native_grid, dry_run):
+    """
+    Fluxo interativo do modo de séries por local: usa coordenadas de um CSV
+    (site, lon, lat) ou os centroides das AOIs selecionadas.
+    """
+    sites_csv = questionary.text(
+        "CSV com coordenadas das torres (site, lon, lat)? Deixe vazio para usar os centroides das AOIs:",
+        default=''
+    ).ask()
+
+    window_pixels = questionary.text(
+        "Janela de pixels ao redor de cada local (0 = só o pixel central, 1 = 3x3, 2 = 5x5...):",
+        validate=lambda v: (v.isdigit() and int(v) <= MAX_WINDOW_PIXELS)
+                           or f"Digite um número inteiro de 0 a {MAX_WINDOW_PIXELS}",
+        default='0'
+    ).ask()
+    window_pixels = int(window_pixels)
+
+    if sites_csv:
+        try:
+            sites = load_sites_csv(sites_csv)
+        except Exception as e:
+            print(f"Erro ao ler o CSV de locais {sites_csv}: {e}")
+            sys.exit(1)
+    else:
+        sites = {}
+        for aoi_basename in selected_aoi_basenames:
+            aoi_path_full = next(shp for shp in shapefiles if shp.endswith(aoi_basename))
+            aoi_name = os.path.splitext(aoi_basename)[0]
+            try:
+                centroid = load_aoi_shape(aoi_path_full).centroid
+                sites[aoi_name] = (centroid.x, centroid.y)
+            except Exception as e:
+                print(f"Erro fatal ao carregar o shapefile {aoi_basename}: {e}")
+                print("Verifique o arquivo e tente novamente. Pulando esta AOI.")
+
+    if not sites:
+        print("Nenhum local para extrair. Saindo.")
+        sys.exit(0)
+
+    print("\n=== RESUMO DA TAREFA ===")
+    print(f"  Locais: {', '.join(sites)}")
+    print(f"  Janela: {2 * window_pixels + 1}x{2 * window_pixels + 1} pixels")
+    print(f"  Período: {start_date} até {end_date}")
+    print(f"  Coleções: {', '.join(selected_collections)}")
+    print(f"  Grade: {'nativa do produto' if native_grid else 'EPSG:4326'}")
+
+    if dry_run:
+        print("\nDry-run: nenhuma extração foi feita.")
+        sys.exit(0)
+
+    confirm = questionary.confirm(
+        "Tudo certo? Deseja iniciar a extração?",
+        default=True
+    ).ask()
+
+    if not confirm:
+        print("Operação cancelada.")
+        sys.exit(0)
+
+    run_site_extraction(sites, selected_collections, start_date, end_date,
+                        window_pixels=window_pixels, native_grid=native_grid)
+
+    print("\n\n===================================")
+    print("  Extração de todas as séries concluída!  ")
+    print(f"  Tabelas salvas em: {SITES_DIR}")
+    print("===================================")
+
+
 def main():
-    """Função principal da ferramenta de download interativa."""
+    """
+    Função principal da ferramenta de download interativa.
+    Com '--dry-run', apenas mostra o plano de execução estimado e sai.
+    """
+    dry_run = '--dry-run' in sys.argv
     
     print("=============================================")
     print("  Ferramenta de Download de Dados MODIS GEE  ")
@@ -22,7 +187,8 @@ def main():
 
     # --- 1. Setup: Criar pastas e autenticar ---
     setup_directories()
-    authenticate_gee()
+    if not dry_run:
+        authenticate_gee()
 
     # --- 2. Selecionar AOIs ---
     shapefiles = find_shapefiles()
@@ -70,11 +236,61 @@ def main():
         print("Nenhuma coleção selecionada. Saindo.")
         sys.exit(0)
 
-    # --- 5. Confirmação e Execução ---
+    # --- 4b. Modo de execução ---
+    mode = questionary.select(
+        "O que você quer gerar?",
+        choices=[MODE_RASTERS, MODE_SITES],
+        default=MODE_RASTERS
+    ).ask()
+
+    # Grade nativa: evita a reprojeção para EPSG:4326 no servidor e mantém
+    # todas as datas de uma AOI exatamente na mesma grade de pixels
+    native_grid = questionary.confirm(
+        "Baixar na grade nativa do produto (sinusoidal MODIS), sem reprojetar para EPSG:4326?",
+        default=False
+    ).ask()
+
+    if mode == MODE_SITES:
+        run_sites_mode(shapefiles, selected_aoi_basenames, selected_collections,
+                       start_date, end_date, native_grid, dry_run)
+        return
+
+    # --- 5. Carregar AOIs e agrupar duplicadas/sobrepostas ---
+    aoi_shapes = {}
+    for aoi_basename in selected_aoi_basenames:
+        aoi_path_full = next(shp for shp in shapefiles if shp.endswith(aoi_basename))
+        aoi_name = os.path.splitext(aoi_basename)[0]
+        try:
+            aoi_shapes[aoi_name] = load_aoi_shape(aoi_path_full)
+        except Exception as e:
+            print(f"Erro fatal ao carregar o shapefile {aoi_basename}: {e}")
+            print("Verifique o arquivo e tente novamente. Pulando esta AOI.")
+
+    aoi_groups = group_aois(aoi_shapes)
+    for group in aoi_groups:
+        for primary, copies in group['aliases'].items():
+            print(f"AOIs {', '.join(copies)} são idênticas a {primary}: "
+                  f"processadas uma única vez.")
+        if len(group['members']) > 1:
+            print(f"AOIs {', '.join(group['members'])} compartilham pixels: "
+                  f"footprint baixado uma única vez ({group['name']}).")
+
+    # --- 6. Confirmação e Execução ---
     print("\n=== RESUMO DA TAREFA ===")
     print(f"  AOIs a processar: {', '.join(selected_aoi_basenames)}")
     print(f"  Período: {start_date} até {end_date}")
     print(f"  Coleções: {', '.join(selected_collections)}")
+    print(f"  Grade: {'nativa do produto' if native_grid else 'EPSG:4326'}")
+
+    # Estimativa de custo e escolha automática da estratégia
+    plan = plan_job(aoi_groups, selected_collections, start_date, end_date,
+                    native_grid=native_grid)
+    print_plan(plan)
+    strategies = {(item['group'], item['collection']): item['strategy'] for item in plan}
+
+    if dry_run:
+        print("\nDry-run: nenhum download foi feito.")
+        sys.exit(0)
     
     confirm = questionary.confirm(
         "Tudo certo? Deseja iniciar o download em lote?",
@@ -85,46 +301,9 @@ def main():
         print("Operação cancelada.")
         sys.exit(0)
 
-    # --- 6. Loop de Processamento (NESTED) ---
-    
-    for aoi_basename in selected_aoi_basenames:
-        print(f"\n\n=======================================================")
-        print(f"   Iniciando processamento para a AOI: {aoi_basename} ")
-        print(f"=======================================================")
-        
-        # --- Carregar a geometria para esta AOI específica ---
-        aoi_path_full = next(shp for shp in shapefiles if shp.endswith(aoi_basename))
-        aoi_name = os.path.splitext(aoi_basename)[0]
-        
-        try:
-            aoi_geom = get_aoi_geometry(aoi_path_full)
-            if aoi_geom is None:
-                print(f"Erro ao carregar geometria para {aoi_basename}. Pulando esta AOI.")
-                continue 
-        except Exception as e:
-            print(f"Erro fatal ao carregar o shapefile {aoi_basename}: {e}")
-            print("Verifique o arquivo e tente novamente. Pulando esta AOI.")
-            continue 
-
-        # *** INÍCIO DA MUDANÇA: Adicionar barra de progresso TQDM ***
-        # Esta barra mostra o progresso das *coleções* para a AOI atual
-        collection_progressbar = tqdm(selected_collections, 
-                                      desc=f"Progresso (AOI: {aoi_name})", 
-                                      unit="coleção")
-        
-        for collection_key in collection_progressbar:
-            # Atualiza a descrição da barra para a coleção atual
-            collection_progressbar.set_postfix_str(collection_key)
-            
-            try:
-                process_collection(aoi_name, collection_key, aoi_geom, start_date, end_date)
-            except Exception as e:
-                # Se algo der errado, registra e continua
-                tqdm.write(f"*** ERRO GERAL ao processar {collection_key} para {aoi_name}: {e}")
-                tqdm.write("   Pulando para a próxima coleção...")
-        # *** FIM DA MUDANÇA ***
-        
-        print(f"\n--- Processamento da AOI {aoi_name} concluído ---")
+    # --- 7. Loop de Processamento (NESTED) ---
+    run_downloads(aoi_groups, selected_collections, start_date, end_date,
+                  strategies, native_grid=native_grid)
 
     print("\n\n===================================")
     print("  Processamento de todas as tarefas concluído!  ")
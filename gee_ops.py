@@ -1,16 +1,28 @@
 import ee
 import sys
+import hashlib
 import io
 import os
 import requests
+import shutil
 import zipfile
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import geopandas as gpd
-from config import RAW_TIF_DIR, CSV_DIR
+import rasterio
+from rasterio.mask import mask as rio_mask
+from rasterio.merge import merge as rio_merge
+from config import RAW_TIF_DIR, CSV_DIR, SHARED_TIF_DIR, SITES_DIR
 from tqdm import tqdm
 
 # === Garantir UTF-8 no Windows ===
-sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding='utf-8')
+# reconfigure() troca a codificação sem desacoplar o buffer (que pode ser
+# de outro dono, ex: a captura de saída do pytest)
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8')
+else:
+    sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding='utf-8')
 
 # === DICIONÁRIO EXPANDIDO DE COLEÇÕES MODIS (V6.1) ===
 # Mapeia um nome amigável para os detalhes da coleção no GEE
@@ -20,13 +32,15 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MOD13Q1',
         'bands': ['NDVI'],
         'scale_factor': 0.0001,
-        'scale_proj': 250
+        'scale_proj': 250,
+        'cadence': '16day'
     },
     'EVI_16Day_250m_Terra (MOD13Q1)': {
         'id': 'MODIS/061/MOD13Q1',
         'bands': ['EVI'],
         'scale_factor': 0.0001,
-        'scale_proj': 250
+        'scale_proj': 250,
+        'cadence': '16day'
     },
     
     # --- Evapotranspiração (ET) ---
@@ -34,38 +48,44 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MOD16A2',
         'bands': ['ET'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'LE_Latente_heat_flux_ET_8Day_500m_Terra (MOD16A2)': {
         'id': 'MODIS/061/MOD16A2',
         'bands': ['LE'],
         'scale_factor': 10000,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'PET_Potential_ET_8Day_500m_Terra (MOD16A2)': {
         'id': 'MODIS/061/MOD16A2',
         'bands': ['PET'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
 
     'ET_Evapotranspiration_8Day_500m_GF_Terra (MOD16A2GF)': {
         'id': 'MODIS/061/MOD16A2GF',
         'bands': ['ET'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'LE_Latente_heat_flux_ET_8Day_500m_GF_Terra (MOD16A2GF)': {
         'id': 'MODIS/061/MOD16A2GF',
         'bands': ['LE'],
         'scale_factor': 10000,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'PET_Potential_ET_8Day_500m_GF_Terra (MOD16A2GF)': {
         'id': 'MODIS/061/MOD16A2GF',
         'bands': ['PET'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
 
     # --- Temperatura da Superfície (LST) ---
@@ -73,13 +93,15 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MOD11A1',
         'bands': ['LST_Day_1km'],
         'scale_factor': 0.02,  # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': 'daily'
     },
     'LST_Night_Daily_1km_Terra (MOD11A1)': {
         'id': 'MODIS/061/MOD11A1',
         'bands': ['LST_Night_1km'],
         'scale_factor': 0.02, # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': 'daily'
     },
 
         # --- Temperatura da Superfície (LST) ---
@@ -87,13 +109,15 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MOD11A2',
         'bands': ['LST_Day_1km'],
         'scale_factor': 0.02,  # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': '8day'
     },
     'LST_Night_8day_1km_Terra (MOD11A2)': {
         'id': 'MODIS/061/MOD11A2',
         'bands': ['LST_Night_1km'],
         'scale_factor': 0.02, # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': '8day'
     },
 
     # --- LAI / FPAR ---
@@ -101,13 +125,15 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MOD15A2H',
         'bands': ['Lai_500m'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'FPAR_8Day_500m_Terra (MOD15A2H)': {
         'id': 'MODIS/061/MOD15A2H',
         'bands': ['Fpar_500m'],
         'scale_factor': 0.01,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
 
     'PAR_Daily_3-hours_500m (MCD18C2)': {
@@ -116,7 +142,8 @@ MODIS_COLLECTIONS = {
                   'GMT_0900_PAR', 'GMT_1200_PAR', 'GMT_1500_PAR',
                   'GMT_1800_PAR', 'GMT_2100_PAR'],
         'scale_factor': 1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': 'daily'
     },
     
     # --- Cobertura de Neve ---
@@ -124,7 +151,8 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MOD10A1',
         'bands': ['NDSI_Snow_Cover'],
         'scale_factor': 1, # É porcentagem
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': 'daily'
     },
     
     # --- Área Queimada ---
@@ -132,7 +160,8 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MCD64A1',
         'bands': ['BurnDate'], # Dia do ano
         'scale_factor': 1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': 'monthly'
     },
     
     # --- Cobertura da Terra ---
@@ -140,7 +169,8 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MCD12Q1',
         'bands': ['LC_Type1'], # Classificação IGBP
         'scale_factor': 1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': 'yearly'
     },
 
     # --- Cobertura da Terra ---
@@ -148,27 +178,31 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MOD17A2HGF',
         'bands': ['Gpp'], # GPP
         'scale_factor': 0.0001,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
 
     'water_mask_250m_Terra (MOD44W)': {
         'id': 'MODIS/006/MOD44W',
         'bands': ['water_mask'], # GPP
         'scale_factor': 1,
-        'scale_proj': 250
+        'scale_proj': 250,
+        'cadence': 'yearly'
     },
     # --- Vegetação (NDVI / EVI) ---
     'NDVI_16Day_250m_Aqua (MYD13Q1)': {
         'id': 'MODIS/061/MYD13Q1',
         'bands': ['NDVI'],
         'scale_factor': 0.0001,
-        'scale_proj': 250
+        'scale_proj': 250,
+        'cadence': '16day'
     },
     'EVI_16Day_250m_Aqua (MYD13Q1)': {
         'id': 'MODIS/061/MYD13Q1',
         'bands': ['EVI'],
         'scale_factor': 0.0001,
-        'scale_proj': 250
+        'scale_proj': 250,
+        'cadence': '16day'
     },
     
     # --- Evapotranspiração (ET) ---
@@ -176,19 +210,22 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MYD16A2',
         'bands': ['ET'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'LE_Latente_heat_flux_ET_8Day_500m_Aqua (MYD16A2)': {
         'id': 'MODIS/061/MYD16A2',
         'bands': ['LE'],
         'scale_factor': 10000,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'PET_Potential_ET_8Day_500m_Aqua (MYD16A2)': {
         'id': 'MODIS/061/MYD16A2',
         'bands': ['PET'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
 
     # --- Temperatura da Superfície (LST) ---
@@ -196,13 +233,15 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MYD11A1',
         'bands': ['LST_Day_1km'],
         'scale_factor': 0.02,  # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': 'daily'
     },
     'LST_Night_Daily_1km_Aqua (MYD11A1)': {
         'id': 'MODIS/061/MYD11A1',
         'bands': ['LST_Night_1km'],
         'scale_factor': 0.02, # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': 'daily'
     },
 
         # --- Temperatura da Superfície (LST) ---
@@ -210,13 +249,15 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MYD11A2',
         'bands': ['LST_Day_1km'],
         'scale_factor': 0.02,  # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': '8day'
     },
     'LST_Night_8day_1km_Aqua (MYD11A2)': {
         'id': 'MODIS/061/MYD11A2',
         'bands': ['LST_Night_1km'],
         'scale_factor': 0.02, # Converte para Kelvin
-        'scale_proj': 1000
+        'scale_proj': 1000,
+        'cadence': '8day'
     },
 
     # --- LAI / FPAR ---
@@ -224,13 +265,15 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MYD15A2H',
         'bands': ['Lai_500m'],
         'scale_factor': 0.1,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     'FPAR_8Day_500m_Aqua (MYD15A2H)': {
         'id': 'MODIS/061/MYD15A2H',
         'bands': ['Fpar_500m'],
         'scale_factor': 0.01,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
     
     # --- Cobertura de Neve ---
@@ -238,7 +281,8 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MYD10A1',
         'bands': ['NDSI_Snow_Cover'],
         'scale_factor': 1, # É porcentagem
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': 'daily'
     },
 
     # --- Cobertura da Terra ---
@@ -246,11 +290,39 @@ MODIS_COLLECTIONS = {
         'id': 'MODIS/061/MYD17A2H',
         'bands': ['Gpp'], # GPP
         'scale_factor': 0.0001,
-        'scale_proj': 500
+        'scale_proj': 500,
+        'cadence': '8day'
     },
 
 }
 
+# Quantas imagens entram em cada requisição de médias em lote
+MEANS_BATCH_SIZE = 500
+
+# Limite de feições retornadas por uma requisição getInfo (amostragem por local)
+SAMPLE_MAX_FEATURES = 5000
+
+# Maior janela (pixels ao redor do local) cuja área (2N+1)² cabe em uma requisição
+MAX_WINDOW_PIXELS = (int(SAMPLE_MAX_FEATURES ** 0.5) - 1) // 2
+
+# Projeção sinusoidal da grade MODIS (esfera de raio 6371007.181 m)
+MODIS_SINUSOIDAL = '+proj=sinu +R=6371007.181 +nadgrids=@null +wktext'
+
+# Tamanho real do pixel (m) na grade nativa para cada resolução nominal
+NATIVE_PIXEL_SIZE_M = {
+    250: 231.656358263889,
+    500: 463.312716527778,
+    1000: 926.625433055556,
+}
+
+# Sessão HTTP compartilhada: reaproveita conexões (keep-alive) entre downloads
+# e entre jobs quando o daemon está em execução
+HTTP_POOL_SIZE = 16
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+))
+
 
 def authenticate_gee():
     """Inicializa ou autentica no Google Earth Engine."""
@@ -269,9 +341,9 @@ def authenticate_gee():
             sys.exit(1)
 
 
-def get_aoi_geometry(shapefile_path):
+def load_aoi_shape(shapefile_path):
     """
-    Lê um shapefile, dissolve em uma única geometria e converte para ee.Geometry.
+    Lê um shapefile e dissolve em uma única geometria shapely (EPSG:4326).
     """
     print(f"Carregando AOI de: {shapefile_path}")
     gdf = gpd.read_file(shapefile_path)
@@ -282,154 +354,413 @@ def get_aoi_geometry(shapefile_path):
         gdf = gdf.to_crs(epsg=4326)
         
     # Dissolve todas as feições em uma única
-    gdf_union = gdf.unary_union
-    
+    return gdf.unary_union
+
+
+def shape_to_ee_geometry(shape):
+    """
+    Converte uma geometria shapely (EPSG:4326) para ee.Geometry.
+    """
     # Converte para GeoJSON (dicionário)
-    gjson = gdf_union.__geo_interface__
+    gjson = shape.__geo_interface__
     
     # Cria a geometria do GEE
     if gjson['type'] == 'Polygon':
-        aoi_geom = ee.Geometry.Polygon(gjson['coordinates'])
+        return ee.Geometry.Polygon(gjson['coordinates'])
     elif gjson['type'] == 'MultiPolygon':
-        aoi_geom = ee.Geometry.MultiPolygon(gjson['coordinates'])
+        return ee.Geometry.MultiPolygon(gjson['coordinates'])
     else:
         print(f"Tipo de geometria não suportado: {gjson['type']}")
         return None
+
+
+def get_aoi_geometry(shapefile_path):
+    """
+    Lê um shapefile, dissolve em uma única geometria e converte para ee.Geometry.
+    """
+    aoi_geom = shape_to_ee_geometry(load_aoi_shape(shapefile_path))
+    if aoi_geom is None:
+        return None
         
     print("Geometria AOI carregada no GEE.")
     return aoi_geom
 
 
-def process_collection(aoi_name, collection_key, aoi_geom, start_date, end_date):
+def _tile_regions(aoi_geom, tile_grid):
+    """
+    Divide o retângulo envolvente da AOI em uma grade tile_grid x tile_grid,
+    para que cada pedaço fique abaixo do limite de tamanho do getDownloadURL.
+    """
+    ring = aoi_geom.bounds().coordinates().get(0).getInfo()
+    xs = [pt[0] for pt in ring]
+    ys = [pt[1] for pt in ring]
+    xmin, xmax, ymin, ymax = min(xs), max(xs), min(ys), max(ys)
+    dx = (xmax - xmin) / tile_grid
+    dy = (ymax - ymin) / tile_grid
+    return [
+        ee.Geometry.Rectangle([xmin + col * dx, ymin + row * dy,
+                               xmin + (col + 1) * dx, ymin + (row + 1) * dy])
+        for row in range(tile_grid) for col in range(tile_grid)
+    ]
+
+
+def _download_tif(image, name_prefix, region, grid_params, tif_output_dir, tif_path,
+                  tile_regions=None):
+    """
+    Baixa uma imagem já recortada como GeoTIFF em tif_path.
+    'grid_params' define a grade de saída: {'scale': ...} ou, na grade nativa,
+    {'crs': ..., 'crs_transform': ...}.
+    Se 'tile_regions' for informado, baixa cada tile e junta localmente.
+    Lança exceção em caso de erro (o arquivo temporário é removido).
+    """
+    if tile_regions:
+        tile_paths = []
+        try:
+            for k, tile in enumerate(tile_regions):
+                tile_prefix = f"{name_prefix}_tile{k}"
+                tile_path = os.path.join(tif_output_dir, f"{tile_prefix}.temp_tile.tif")
+                _download_tif(image, tile_prefix, tile, grid_params, tif_output_dir, tile_path)
+                tile_paths.append(tile_path)
+
+            sources = [rasterio.open(path) for path in tile_paths]
+            try:
+                data, transform = rio_merge(sources)
+                profile = sources[0].profile.copy()
+            finally:
+                for src in sources:
+                    src.close()
+            profile.update(height=data.shape[1], width=data.shape[2], transform=transform)
+            with rasterio.open(tif_path, 'w', **profile) as dst:
+                dst.write(data)
+        finally:
+            for path in tile_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        return
+
+    temp_download_path = None 
+    try:
+        url = image.getDownloadURL({
+            'name': name_prefix, 'region': region, 'format': 'GEO_TIFF', **grid_params
+        })
+        
+        r = HTTP_SESSION.get(url, stream=True)
+        r.raise_for_status()
+        
+        temp_download_path = os.path.join(tif_output_dir, f"{name_prefix}.temp_download")
+        with open(temp_download_path, 'wb') as f:
+            f.write(r.content)
+        
+        if zipfile.is_zipfile(temp_download_path):
+            with zipfile.ZipFile(temp_download_path, 'r') as z:
+                for file in z.namelist():
+                    if file.lower().endswith('.tif'):
+                        extracted_file_path = z.extract(file, tif_output_dir)
+                        if os.path.exists(tif_path): os.remove(tif_path)
+                        os.rename(extracted_file_path, tif_path)
+                        break 
+            os.remove(temp_download_path)
+        
+        else:
+            os.rename(temp_download_path, tif_path)
+
+    except Exception:
+        if temp_download_path and os.path.exists(temp_download_path):
+            os.remove(temp_download_path)
+        raise
+
+
+def clip_tif_local(src_tif_path, shape, dst_tif_path):
+    """
+    Recorta localmente um TIF (baixado para o footprint compartilhado)
+    para a geometria de uma AOI, sem nova requisição ao GEE.
+    O recorte mantém o tipo de dado do TIF original, igual ao de uma AOI
+    isolada. Fora da AOI fica o nodata do TIF ou, sem ele, 0, que é o valor
+    que o GEE grava nos pixels mascarados.
+    """
+    with rasterio.open(src_tif_path) as src:
+        nodata = src.nodata if src.nodata is not None else 0
+        # A AOI está em EPSG:4326; o raster pode estar em outra projeção
+        shapes = gpd.GeoSeries([shape], crs='EPSG:4326').to_crs(src.crs)
+        data, transform = rio_mask(
+            src, [g.__geo_interface__ for g in shapes],
+            crop=True, nodata=nodata
+        )
+        profile = src.profile.copy()
+        profile.update(height=data.shape[1], width=data.shape[2], transform=transform)
+
+    with rasterio.open(dst_tif_path, 'w', **profile) as dst:
+        dst.write(data)
+
+
+def _query_collection(collection_key, region, start_date, end_date):
+    """
+    Filtra a coleção por data e região, seleciona as bandas e aplica o fator de escala.
+    """
+    collection_info = MODIS_COLLECTIONS[collection_key]
+    scale_factor = collection_info.get('scale_factor', 1.0)
+
+    collection = (
+        ee.ImageCollection(collection_info['id'])
+        .filterDate(start_date, end_date)
+        .filterBounds(region)
+        .select(collection_info['bands'])
+    )
+
+    if scale_factor != 1.0:
+        collection = collection.map(
+            lambda img: img.multiply(scale_factor)
+                         .copyProperties(img, img.propertyNames())
+        )
+    return collection
+
+
+def _native_projection(collection):
+    """
+    Retorna a projeção nativa (crs e crsTransform) da primeira banda da coleção.
+    Usar essa grade fixa em todas as datas evita a reprojeção no servidor e
+    garante que todos os TIFs de uma AOI fiquem exatamente alinhados.
+    """
+    info = ee.Image(collection.first()).select(0).projection().getInfo()
+    return {'crs': info.get('crs') or info.get('wkt'), 'transform': info['transform']}
+
+
+def _batched_means(collection, aoi_geom, reduce_params, total_images):
+    """
+    Calcula as médias de todas as imagens da coleção em poucas requisições
+    (lotes de MEANS_BATCH_SIZE), em vez de um reduceRegion por imagem.
+    Retorna uma lista de dicionários {banda: média} na ordem da coleção.
+    Se um lote falhar (timeout, limite de memória...), suas posições ficam
+    como None e a média é calculada imagem a imagem durante o download.
+    """
+    def _mean_feature(img):
+        stats = img.reduceRegion(
+            reducer=ee.Reducer.mean(), geometry=aoi_geom, maxPixels=1e10, **reduce_params
+        )
+        return ee.Feature(None, stats)
+
+    features = collection.map(_mean_feature)
+    means = [None] * total_images
+    for offset in range(0, total_images, MEANS_BATCH_SIZE):
+        try:
+            batch = features.toList(MEANS_BATCH_SIZE, offset).getInfo()
+        except Exception as e:
+            tqdm.write(f"   *** ERRO no lote de médias {offset}-{offset + MEANS_BATCH_SIZE}: {e}")
+            tqdm.write("   As médias desse lote serão calculadas imagem a imagem.")
+            continue
+        for k, feature in enumerate(batch[:total_images - offset]):
+            means[offset + k] = feature.get('properties', {})
+    return means
+
+
+def process_collection(aoi_name, collection_key, aoi_geom, start_date, end_date,
+                       clip_targets=None, workers=1, batched_means=False, tile_grid=1,
+                       native_grid=False, aliases=None):
     """
     Processa uma única coleção: baixa todos os TIFs e gera um CSV de médias.
+
+    Se 'clip_targets' ({nome_aoi: geometria_shapely}) for informado, 'aoi_geom'
+    é o footprint compartilhado do grupo: cada imagem é baixada uma única vez
+    e recortada localmente para cada AOI. As médias continuam sendo calculadas
+    no GEE (reduceRegion na geometria de cada AOI), como para AOIs isoladas.
+
+    'aliases' ({nome_aoi: [cópias]}) lista AOIs com geometria idêntica a um
+    membro: TIFs e médias são calculados só para o membro e copiados.
+
+    A estratégia de execução (normalmente escolhida pelo planner) controla:
+    - workers: número de imagens baixadas em paralelo;
+    - batched_means: médias calculadas em lote em vez de uma requisição por imagem;
+    - tile_grid: divide a região em uma grade NxN quando a imagem é grande demais.
+
+    Com 'native_grid=True', as imagens são exportadas na projeção nativa do
+    produto (ex: sinusoidal do MODIS) com um crsTransform fixo, sem reprojeção
+    para EPSG:4326; os arquivos vão para '<coleção>_native'.
     """
     collection_info = MODIS_COLLECTIONS[collection_key]
     
-    collection_id = collection_info['id']
     bands = collection_info['bands']
-    scale_factor = collection_info.get('scale_factor', 1.0)
     scale_proj = collection_info['scale_proj']
     
     # Não vamos mais imprimir isso, a barra de progresso principal mostra
     # print(f"\n--- Iniciando processamento para: {collection_key} [AOI: {aoi_name}] ---")
     
     # --- 1. Criar pastas de saída específicas ---
-    tif_output_dir = os.path.join(RAW_TIF_DIR, aoi_name, collection_key)
-    csv_output_dir = os.path.join(CSV_DIR, aoi_name)
+    # TIFs na grade nativa ficam separados para não misturar grades diferentes
+    collection_dir = f"{collection_key}_native" if native_grid else collection_key
+    if clip_targets:
+        tif_output_dir = os.path.join(SHARED_TIF_DIR, aoi_name, collection_dir)
+        target_names = list(clip_targets)
+        target_geoms = {name: shape_to_ee_geometry(shape) for name, shape in clip_targets.items()}
+    else:
+        tif_output_dir = os.path.join(RAW_TIF_DIR, aoi_name, collection_dir)
+        target_names = [aoi_name]
+        target_geoms = {aoi_name: aoi_geom}
+    aliases = {t: aliases[t] for t in target_names if aliases and aliases.get(t)}
+    alias_names = [alias for copies in aliases.values() for alias in copies]
     os.makedirs(tif_output_dir, exist_ok=True)
-    os.makedirs(csv_output_dir, exist_ok=True)
+    for target in target_names + alias_names:
+        os.makedirs(os.path.join(RAW_TIF_DIR, target, collection_dir), exist_ok=True)
+        os.makedirs(os.path.join(CSV_DIR, target), exist_ok=True)
     
     # --- 2. Consultar a coleção ---
-    collection = (
-        ee.ImageCollection(collection_id)
-        .filterDate(start_date, end_date)
-        .filterBounds(aoi_geom)
-        .select(bands)
-    )
-
-    if scale_factor != 1.0:
-        collection = collection.map(
-            lambda img: img.multiply(scale_factor)
-                         .copyProperties(img, img.propertyNames())
-        )
+    collection = _query_collection(collection_key, aoi_geom, start_date, end_date)
 
     # --- 3. Obter o tamanho da coleção ANTES de criar a lista ---
     total_images = collection.size().getInfo()
+    mean_data = {target: [] for target in target_names + alias_names}
     
     if total_images == 0:
         # Escreve a informação sem quebrar a barra de progresso
         tqdm.write(f"[{collection_key}] Nenhuma imagem encontrada para este período/região.")
-        mean_data_list = []
     else:
         # print(f"Total de imagens encontradas: {total_images}") # <-- Substituído pela barra
         
-        # --- 4. Iterar e baixar imagens ---
+        # --- 4. Preparar a iteração ---
         image_list = collection.toList(total_images)
-        mean_data_list = [] 
 
-        # *** Adiciona a barra de progresso TQDM para imagens ***
-        # 'leave=False' faz a barra desaparecer após a conclusão
-        # 'unit="img"' apenas muda o texto da unidade
-        image_progressbar = tqdm(range(total_images), 
-                                 desc="Imagens", 
-                                 unit="img", 
-                                 leave=False) 
-        
-        for i in image_progressbar:
+        # Todas as datas em uma única requisição (na mesma ordem da lista)
+        dates = (
+            collection.aggregate_array('system:time_start')
+            .map(lambda t: ee.Date(t).format('YYYY-MM-dd'))
+            .getInfo()
+        )
+
+        # Grade de saída: nativa (crsTransform fixo) ou EPSG:4326 na escala da coleção
+        if native_grid:
+            native_proj = _native_projection(collection)
+            download_params = {'crs': native_proj['crs'], 'crs_transform': native_proj['transform']}
+            reduce_params = {'crs': native_proj['crs'], 'crsTransform': native_proj['transform']}
+        else:
+            download_params = {'scale': scale_proj}
+            reduce_params = {'scale': scale_proj}
+
+        precomputed_means = None
+        if batched_means:
+            precomputed_means = {
+                target: _batched_means(collection, target_geoms[target], reduce_params, total_images)
+                for target in target_names
+            }
+
+        tile_regions = _tile_regions(aoi_geom, tile_grid) if tile_grid > 1 else None
+
+        def process_image(i):
+            """Baixa/recorta uma imagem e retorna {aoi: linha_do_csv} (ou None em caso de erro)."""
+            # Erros inesperados afetam só esta imagem, não a coleção inteira
+            try:
+                return _process_image(i)
+            except Exception as e:
+                tqdm.write(f"   *** ERRO ao processar a imagem {i + 1}/{total_images} de {collection_key}: {e}")
+                return None
+
+        def _process_image(i):
             image = ee.Image(image_list.get(i))
-            date_str = image.date().format('YYYY-MM-dd').getInfo()
-            
-            # Atualiza a barra com a data da imagem atual
-            image_progressbar.set_postfix_str(date_str) 
-            
+            date_str = dates[i]
             name_prefix = f"{collection_key}_{date_str}"
             
             # --- 4a. Download do GeoTIFF ---
             tif_path = os.path.join(tif_output_dir, f"{name_prefix}.tif")
+            target_tif_paths = {
+                target: os.path.join(RAW_TIF_DIR, target, collection_dir, f"{name_prefix}.tif")
+                for target in target_names
+            }
+            missing_targets = [t for t, p in target_tif_paths.items() if not os.path.exists(p)]
+            alias_tif_paths = {
+                alias: os.path.join(RAW_TIF_DIR, alias, collection_dir, f"{name_prefix}.tif")
+                for alias in alias_names
+            }
             
-            if os.path.exists(tif_path):
+            if os.path.exists(tif_path) or not missing_targets:
                 # Usamos tqdm.write() para não quebrar a barra
                 tqdm.write(f"  [OK] Já existe: {name_prefix}.tif")
             else:
-                # Não precisamos de print, a barra mostra o progresso
-                # print(f"[{i+1}/{total_images}] Baixando: {name_prefix}.tif")
-                temp_download_path = None 
                 try:
-                    image_clipped = image.clip(aoi_geom).reproject(crs='EPSG:4326', scale=scale_proj)
-                    url = image_clipped.getDownloadURL({
-                        'name': name_prefix, 'scale': scale_proj, 'region': aoi_geom, 'format': 'GEO_TIFF'
-                    })
-                    
-                    r = requests.get(url, stream=True)
-                    r.raise_for_status()
-                    
-                    temp_download_path = os.path.join(tif_output_dir, f"{name_prefix}.temp_download")
-                    with open(temp_download_path, 'wb') as f:
-                        f.write(r.content)
-                    
-                    if zipfile.is_zipfile(temp_download_path):
-                        with zipfile.ZipFile(temp_download_path, 'r') as z:
-                            for file in z.namelist():
-                                if file.lower().endswith('.tif'):
-                                    extracted_file_path = z.extract(file, tif_output_dir)
-                                    if os.path.exists(tif_path): os.remove(tif_path)
-                                    os.rename(extracted_file_path, tif_path)
-                                    # tqdm.write(f"  [ZIP] Salvo: {tif_path}") # <-- Opcional, pode poluir
-                                    break 
-                        os.remove(temp_download_path)
-                    
-                    else:
-                        os.rename(temp_download_path, tif_path)
-                        # tqdm.write(f"  [TIF] Salvo: {tif_path}") # <-- Opcional
+                    # Mesmo formato (tipo de dado e máscara) para AOIs isoladas e grupos
+                    image_clipped = image.clip(aoi_geom)
+                    if not native_grid:
+                        image_clipped = image_clipped.reproject(crs='EPSG:4326', scale=scale_proj)
+                    _download_tif(image_clipped, name_prefix, aoi_geom, download_params,
+                                  tif_output_dir, tif_path, tile_regions=tile_regions)
 
                 except Exception as e:
                     # Garantir que erros sejam impressos com tqdm.write
                     tqdm.write(f"   *** ERRO ao baixar {name_prefix}: {e}")
-                    if temp_download_path and os.path.exists(temp_download_path):
-                        os.remove(temp_download_path)
                     if "computation timed out" in str(e).lower():
                         tqdm.write("   *** Dica: Sua AOI pode ser muito complexa. Tente simplificá-la.")
-                    continue 
+                    return None
 
-            # --- 4b. Calcular Média para o CSV ---
-            try:
-                mean_dict = image.reduceRegion(
-                    reducer=ee.Reducer.mean(), geometry=aoi_geom, scale=scale_proj, maxPixels=1e10
-                ).getInfo() 
-                
-                row = {'date': date_str}
-                for band in bands:
-                    row[band] = mean_dict.get(band)
-                mean_data_list.append(row)
-                
-            except Exception as e:
-                tqdm.write(f"   *** ERRO ao calcular média para {name_prefix}: {e}")
+            # --- 4b. Recorte local por AOI (apenas para grupos) ---
+            if clip_targets:
+                for target in missing_targets:
+                    try:
+                        clip_tif_local(tif_path, clip_targets[target], target_tif_paths[target])
+                    except Exception as e:
+                        tqdm.write(f"   *** ERRO ao recortar {name_prefix} para {target}: {e}")
+                # O TIF compartilhado só serve para os recortes: removido quando
+                # todas as AOIs têm o seu (se algum falhou, fica para a próxima execução)
+                if os.path.exists(tif_path) and all(os.path.exists(p) for p in target_tif_paths.values()):
+                    os.remove(tif_path)
+
+            # --- 4c. Copiar os TIFs para as cópias idênticas ---
+            for target, copies in aliases.items():
+                for alias in copies:
+                    if os.path.exists(target_tif_paths[target]) and not os.path.exists(alias_tif_paths[alias]):
+                        try:
+                            shutil.copy2(target_tif_paths[target], alias_tif_paths[alias])
+                        except Exception as e:
+                            tqdm.write(f"   *** ERRO ao copiar {name_prefix} para {alias}: {e}")
+
+            # --- 4d. Calcular Média para o CSV ---
+            rows = {}
+            for target in target_names:
+                try:
+                    # Mesmo método para AOIs isoladas e agrupadas: reduceRegion
+                    # na geometria da própria AOI (nenhum pixel é baixado)
+                    mean_dict = None
+                    if precomputed_means is not None:
+                        mean_dict = precomputed_means[target][i]
+                    if mean_dict is None:
+                        # Sem média em lote (estratégia ou lote com falha)
+                        mean_dict = image.reduceRegion(
+                            reducer=ee.Reducer.mean(), geometry=target_geoms[target],
+                            maxPixels=1e10, **reduce_params
+                        ).getInfo() 
+                    
+                    row = {'date': date_str}
+                    for band in bands:
+                        row[band] = mean_dict.get(band)
+                    rows[target] = row
+                    for alias in aliases.get(target, []):
+                        rows[alias] = dict(row)
+                    
+                except Exception as e:
+                    tqdm.write(f"   *** ERRO ao calcular média para {name_prefix} ({target}): {e}")
+            return rows
+
+        # *** Adiciona a barra de progresso TQDM para imagens ***
+        # 'leave=False' faz a barra desaparecer após a conclusão
+        # 'unit="img"' apenas muda o texto da unidade
+        image_progressbar = tqdm(total=total_images, 
+                                 desc="Imagens", 
+                                 unit="img", 
+                                 leave=False) 
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for rows in executor.map(process_image, range(total_images)):
+                image_progressbar.update(1)
+                if rows:
+                    for target, row in rows.items():
+                        mean_data[target].append(row)
+                    # Atualiza a barra com a data da imagem atual
+                    image_progressbar.set_postfix_str(row['date'])
+        image_progressbar.close()
     
     # --- 5. Salvar o CSV de médias ---
-    if mean_data_list: 
-        csv_filename = f"{collection_key.split(' ')[0]}_means.csv"
-        csv_path = os.path.join(csv_output_dir, csv_filename)
+    for target, mean_data_list in mean_data.items():
+        if not mean_data_list:
+            continue
+        csv_suffix = '_native' if native_grid else ''
+        csv_filename = f"{collection_key.split(' ')[0]}{csv_suffix}_means.csv"
+        csv_path = os.path.join(CSV_DIR, target, csv_filename)
         
         df = pd.DataFrame(mean_data_list)
         df = df.sort_values(by='date')
@@ -438,4 +769,150 @@ def process_collection(aoi_name, collection_key, aoi_geom, start_date, end_date)
         print(f"  ✅ CSV com médias salvo em: {csv_path}")
     
     # Não precisamos de print de conclusão aqui, a barra principal cuida disso
-    # print(f"--- Processamento de {collection_key} concluído ---")
\ No newline at end of file
+    # print(f"--- Processamento de {collection_key} concluído ---")
+
+
+def _site_windows(sites, window_pixels, pixel_size):
+    """
+    Monta uma FeatureCollection com uma feição por local, com a propriedade 'site':
+    o próprio ponto ou, com janela, um quadrado de (2 * window_pixels + 1) pixels
+    de lado centrado no local. Janelas de locais vizinhos podem se sobrepor.
+    """
+    features = []
+    for name, (lon, lat) in sites.items():
+        geom = ee.Geometry.Point([lon, lat])
+        if window_pixels > 0:
+            geom = geom.buffer((window_pixels + 0.5) * pixel_size).bounds()
+        features.append(ee.Feature(geom, {'site': name}))
+    return ee.FeatureCollection(features)
+
+
+def site_table_prefix(sites, collection_key, start_date, end_date, window_pixels=0,
+                      native_grid=False):
+    """
+    Prefixo dos arquivos de séries por local. Identifica o conjunto de locais
+    (quantidade + hash dos nomes e coordenadas), a janela e o período, para que
+    execuções com outros locais ou parâmetros não sobrescrevam tabelas anteriores.
+    Ex: 'NDVI_16Day_250m_Terra_sites3_1a2b3c4d_w1_2020-01-01_2021-01-01'.
+    """
+    site_key = ';'.join(f"{name},{lon:.6f},{lat:.6f}" for name, (lon, lat) in sorted(sites.items()))
+    site_hash = hashlib.sha1(site_key.encode('utf-8')).hexdigest()[:8]
+    short_name = collection_key.split(' ')[0]
+    suffix = '_native' if native_grid else ''
+    return (f"{short_name}{suffix}_sites{len(sites)}_{site_hash}_w{window_pixels}_"
+            f"{start_date}_{end_date}")
+
+
+def extract_site_series(sites, collection_key, start_date, end_date, window_pixels=0,
+                        native_grid=False):
+    """
+    Extrai a série temporal completa de uma coleção nos locais (torres) informados,
+    sem baixar rasters: poucas requisições sampleRegions em lotes de imagens.
+
+    'sites' é um dicionário {nome: (lon, lat)} em EPSG:4326. Com 'window_pixels' > 0,
+    extrai todos os pixels de uma janela (2N+1)x(2N+1) ao redor de cada local
+    (N até MAX_WINDOW_PIXELS; na grade nativa, com o tamanho real do pixel).
+    Cada pixel amostrado carrega o nome do seu local, então locais próximos ou
+    com janelas sobrepostas recebem cada um a sua janela completa. Pixels
+    mascarados não geram linha.
+
+    Salva duas tabelas em SITES_DIR, com o prefixo de site_table_prefix():
+    - <prefixo>_pixels.csv: uma linha por local/data/pixel (lon/lat em graus);
+    - <prefixo>.csv: média da janela por local/data.
+    """
+    collection_info = MODIS_COLLECTIONS[collection_key]
+    bands = collection_info['bands']
+    scale_proj = collection_info['scale_proj']
+
+    if not 0 <= window_pixels <= MAX_WINDOW_PIXELS:
+        raise ValueError(f"Janela de {window_pixels} pixels fora do limite (0 a {MAX_WINDOW_PIXELS}): "
+                         f"uma janela não pode passar de {SAMPLE_MAX_FEATURES} pixels por local.")
+
+    # Na grade nativa a janela usa o tamanho real do pixel MODIS, não o nominal
+    pixel_size = NATIVE_PIXEL_SIZE_M.get(scale_proj, scale_proj) if native_grid else scale_proj
+
+    site_windows = _site_windows(sites, window_pixels, pixel_size)
+    collection = _query_collection(collection_key, site_windows.geometry(), start_date, end_date)
+
+    total_images = collection.size().getInfo()
+    if total_images == 0:
+        tqdm.write(f"[{collection_key}] Nenhuma imagem encontrada para este período/região.")
+        return None
+
+    # A grade nativa vale só para a amostragem; o local vem da propriedade 'site'
+    # e as coordenadas de pixelLonLat, sempre em graus
+    if native_grid:
+        native_proj = _native_projection(collection)
+        sample_params = {'projection': ee.Projection(native_proj['crs'], native_proj['transform'])}
+    else:
+        sample_params = {'projection': 'EPSG:4326', 'scale': scale_proj}
+
+    pixel_lonlat = ee.Image.pixelLonLat().rename(['pixel_lon', 'pixel_lat'])
+
+    def _sample_image(windows):
+        def _sample(img):
+            date = img.date().format('YYYY-MM-dd')
+            samples = img.addBands(pixel_lonlat).sampleRegions(
+                collection=windows, properties=['site'], **sample_params
+            )
+            return samples.map(lambda f: f.set('date', date))
+        return _sample
+
+    # Lotes de no máximo SAMPLE_MAX_FEATURES feições por requisição: se todos os
+    # locais não cabem numa imagem, divide também os locais em grupos
+    pixels_per_site = (2 * window_pixels + 1) ** 2
+    sites_per_chunk = min(len(sites), SAMPLE_MAX_FEATURES // pixels_per_site)
+    site_names = list(sites)
+    site_chunks = [
+        {name: sites[name] for name in site_names[k:k + sites_per_chunk]}
+        for k in range(0, len(site_names), sites_per_chunk)
+    ]
+    chunk_images = max(1, SAMPLE_MAX_FEATURES // (sites_per_chunk * pixels_per_site))
+
+    image_list = collection.toList(total_images)
+    records = []
+    chunk_progressbar = tqdm([(chunk_sites, offset) for chunk_sites in site_chunks
+                              for offset in range(0, total_images, chunk_images)],
+                             desc="Lotes de amostragem",
+                             unit="lote",
+                             leave=False)
+    for chunk_sites, offset in chunk_progressbar:
+        windows = (site_windows if len(site_chunks) == 1
+                   else _site_windows(chunk_sites, window_pixels, pixel_size))
+        chunk = ee.ImageCollection(image_list.slice(offset, offset + chunk_images))
+        try:
+            table = chunk.map(_sample_image(windows)).flatten().getInfo()
+        except Exception as e:
+            tqdm.write(f"   *** ERRO no lote {offset}-{offset + chunk_images} de {collection_key} "
+                       f"({', '.join(chunk_sites)}): {e}")
+            continue
+
+        for feature in table['features']:
+            props = feature['properties']
+            records.append({
+                'site': props['site'],
+                'date': props['date'],
+                'lon': props.get('pixel_lon'),
+                'lat': props.get('pixel_lat'),
+                **{band: props.get(band) for band in bands},
+            })
+
+    if not records:
+        return None
+
+    # --- Salvar as tabelas ---
+    prefix = site_table_prefix(sites, collection_key, start_date, end_date,
+                               window_pixels=window_pixels, native_grid=native_grid)
+
+    df_pixels = pd.DataFrame(records).sort_values(by=['site', 'date', 'lat', 'lon'])
+    pixels_path = os.path.join(SITES_DIR, f"{prefix}_pixels.csv")
+    df_pixels.to_csv(pixels_path, index=False, encoding='utf-8-sig')
+
+    df_pixels[bands] = df_pixels[bands].apply(pd.to_numeric, errors='coerce')
+    df_means = df_pixels.groupby(['site', 'date'], as_index=False)[bands].mean()
+    df_means['n_pixels'] = df_pixels.groupby(['site', 'date'])[bands[0]].count().values
+    means_path = os.path.join(SITES_DIR, f"{prefix}.csv")
+    df_means.to_csv(means_path, index=False, encoding='utf-8-sig')
+
+    print(f"  ✅ Séries por local salvas em: {means_path}")
+    return means_path
@@ -0,0 +1,190 @@
+import math
+from datetime import datetime
+import geopandas as gpd
+from shapely.geometry import box
+from gee_ops import MODIS_COLLECTIONS, MEANS_BATCH_SIZE, MODIS_SINUSOIDAL, NATIVE_PIXEL_SIZE_M
+
+# === PARÂMETROS DO MODELO DE CUSTO ===
+# Valores aproximados, medidos em downloads típicos; servem apenas para
+# comparar estratégias entre si, não como previsão exata.
+
+# Latência média de uma requisição ao GEE (getInfo / getDownloadURL / GET)
+REQUEST_LATENCY_S = 1.5
+
+# Latência de um lote de médias (reduceRegion mapeado sobre várias imagens)
+MEANS_BATCH_LATENCY_S = 10.0
+
+# Banda de download disponível (bytes/s), compartilhada entre os workers
+DOWNLOAD_BANDWIDTH_BPS = 5e6
+
+# Limite de tamanho do getDownloadURL no GEE (bytes); usamos 80% como margem
+DOWNLOAD_LIMIT_BYTES = 48 * 1024 ** 2
+DOWNLOAD_LIMIT_MARGIN = 0.8
+
+# Opções de concorrência testadas pelo planejador
+WORKER_OPTIONS = [1, 2, 4, 8]
+
+# Custo extra por worker adicional (cotas/competição no GEE)
+WORKER_OVERHEAD_S = 2.0
+
+# Intervalo entre imagens (dias) para cada cadência
+CADENCE_DAYS = {
+    'daily': 1,
+    '8day': 8,
+    '16day': 16,
+    'monthly': 365.25 / 12,
+    'yearly': 365.25,
+}
+
+
+def get_cadence_days(collection_key):
+    """
+    Retorna o intervalo (em dias) entre imagens de uma coleção, pelo campo
+    'cadence' de MODIS_COLLECTIONS. Sem o campo, assume diária
+    (estimativa conservadora).
+    """
+    cadence = MODIS_COLLECTIONS[collection_key].get('cadence')
+    return CADENCE_DAYS.get(cadence, 1)
+
+
+def _bbox_area_m2(shape):
+    """Área (m²) do retângulo envolvente da AOI, que é o que o GEE exporta."""
+    bbox = gpd.GeoSeries([box(*shape.bounds)], crs='EPSG:4326')
+    return float(bbox.to_crs('EPSG:6933').area.iloc[0])
+
+
+def _pixels_per_image(shape, scale_proj, native_grid):
+    """
+    Pixels exportados por imagem. Na grade nativa o GEE exporta o retângulo
+    envolvente na projeção sinusoidal, com o tamanho real do pixel MODIS.
+    """
+    if not native_grid:
+        return math.ceil(_bbox_area_m2(shape) / scale_proj ** 2)
+    xmin, ymin, xmax, ymax = (
+        gpd.GeoSeries([shape], crs='EPSG:4326').to_crs(MODIS_SINUSOIDAL).total_bounds
+    )
+    pixel_size = NATIVE_PIXEL_SIZE_M.get(scale_proj, scale_proj)
+    return math.ceil((xmax - xmin) / pixel_size) * math.ceil((ymax - ymin) / pixel_size)
+
+
+def _bytes_per_pixel(collection_info):
+    """Bytes por pixel/banda: float32 quando há fator de escala, senão o inteiro de 16 bits."""
+    if collection_info.get('scale_factor', 1.0) != 1.0:
+        return 4
+    return 2
+
+
+def _predict_time(n_images, image_bytes, tiles, batched_means, n_mean_regions, workers):
+    """Tempo previsto (s) para uma coleção dada uma estratégia."""
+    # Requisições fixas: tamanho da coleção + lista de datas
+    fixed_s = 2 * REQUEST_LATENCY_S
+
+    # Por imagem: getDownloadURL + GET para cada tile
+    per_image_requests = 2 * tiles
+    if batched_means:
+        fixed_s += (n_mean_regions * math.ceil(n_images / MEANS_BATCH_SIZE)
+                    * MEANS_BATCH_LATENCY_S)
+    else:
+        per_image_requests += n_mean_regions  # um reduceRegion por AOI
+
+    request_s = n_images * per_image_requests * REQUEST_LATENCY_S / workers
+    transfer_s = n_images * image_bytes / DOWNLOAD_BANDWIDTH_BPS
+    return fixed_s + max(request_s, transfer_s) + (workers - 1) * WORKER_OVERHEAD_S
+
+
+def estimate_collection(collection_key, footprint, start_date, end_date, n_members=1,
+                        native_grid=False):
+    """
+    Estima o custo de baixar uma coleção para um footprint e escolhe a
+    estratégia (tiles, médias em lote, workers) com menor tempo previsto.
+    'n_members' é o número de AOIs do grupo (uma média por AOI).
+    'native_grid' usa a grade sinusoidal nativa em vez de EPSG:4326.
+    """
+    collection_info = MODIS_COLLECTIONS[collection_key]
+    n_bands = len(collection_info['bands'])
+    scale_proj = collection_info['scale_proj']
+
+    days = (datetime.strptime(end_date, '%Y-%m-%d')
+            - datetime.strptime(start_date, '%Y-%m-%d')).days
+    n_images = max(0, math.ceil(days / get_cadence_days(collection_key)))
+
+    pixels = _pixels_per_image(footprint, scale_proj, native_grid)
+    image_bytes = pixels * n_bands * _bytes_per_pixel(collection_info)
+
+    # Tiles: divide a região em uma grade NxN até caber no limite do GEE
+    limit = DOWNLOAD_LIMIT_BYTES * DOWNLOAD_LIMIT_MARGIN
+    grid = max(1, math.ceil(math.sqrt(image_bytes / limit)))
+    tiles = grid * grid
+
+    # Testa todas as combinações e fica com a mais rápida
+    best = None
+    for batched_means in [False, True]:
+        for workers in WORKER_OPTIONS:
+            seconds = _predict_time(n_images, image_bytes, tiles,
+                                    batched_means, n_members, workers)
+            if best is None or seconds < best['seconds']:
+                best = {
+                    'seconds': seconds,
+                    'batched_means': batched_means,
+                    'workers': workers,
+                }
+
+    requests_total = 2 + n_images * 2 * tiles
+    if best['batched_means']:
+        requests_total += n_members * math.ceil(n_images / MEANS_BATCH_SIZE)
+    else:
+        requests_total += n_members * n_images
+
+    return {
+        'collection': collection_key,
+        'images': n_images,
+        'pixels_per_image': pixels,
+        'bytes_total': n_images * image_bytes,
+        'requests': requests_total,
+        'seconds': best['seconds'],
+        'native_grid': native_grid,
+        'strategy': {
+            'tile_grid': grid,
+            'batched_means': best['batched_means'],
+            'workers': best['workers'],
+        },
+    }
+
+
+def plan_job(aoi_groups, collection_keys, start_date, end_date, native_grid=False):
+    """
+    Monta o plano de execução (dry-run) para todos os grupos de AOI e coleções.
+    Retorna uma lista de dicionários {'group', 'collection', ...estimativas}.
+    """
+    plan = []
+    for group in aoi_groups:
+        for collection_key in collection_keys:
+            estimate = estimate_collection(collection_key, group['footprint'],
+                                           start_date, end_date,
+                                           n_members=len(group['members']),
+                                           native_grid=native_grid)
+            estimate['group'] = group['name']
+            plan.append(estimate)
+    return plan
+
+
+def print_plan(plan):
+    """Imprime o plano de execução e os totais."""
+    print("\n=== PLANO DE EXECUÇÃO (estimativa) ===")
+    if plan:
+        grid = 'nativa do produto (sinusoidal MODIS)' if plan[0]['native_grid'] else 'EPSG:4326'
+        print(f"  Estimativa para a grade: {grid}")
+    for item in plan:
+        strategy = item['strategy']
+        print(f"  [{item['group']}] {item['collection']}")
+        print(f"      ~{item['images']} imagens | ~{item['pixels_per_image']:,} px/imagem | "
+              f"~{item['bytes_total'] / 1e9:.2f} GB | ~{item['requests']} requisições")
+        print(f"      Estratégia: tiles {strategy['tile_grid']}x{strategy['tile_grid']}, "
+              f"médias em lote: {'sim' if strategy['batched_means'] else 'não'}, "
+              f"workers: {strategy['workers']} | tempo previsto: ~{item['seconds'] / 60:.1f} min")
+
+    total_bytes = sum(item['bytes_total'] for item in plan)
+    total_requests = sum(item['requests'] for item in plan)
+    total_seconds = sum(item['seconds'] for item in plan)
+    print(f"  TOTAL: ~{total_bytes / 1e9:.2f} GB | ~{total_requests} requisições | "
+          f"~{total_seconds / 60:.1f} min")
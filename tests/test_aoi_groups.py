@@ -0,0 +1,71 @@
+import os
+import pytest
+from shapely.affinity import translate
+from shapely.geometry import Point, box
+from aoi_groups import DUPLICATE_TOLERANCE_DEG, group_aois, is_duplicate
+
+AOI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'aoi')
+
+
+def test_identical_aois_become_aliases():
+    shape = box(-60, -3, -59.5, -2.5)
+    groups = group_aois({'A': shape, 'A_copia': box(-60, -3, -59.5, -2.5)})
+
+    assert len(groups) == 1
+    assert groups[0]['name'] == 'A'
+    assert list(groups[0]['members']) == ['A']
+    assert groups[0]['aliases'] == {'A': ['A_copia']}
+
+
+def test_is_duplicate_within_tolerance():
+    shape = Point(-59, -2).buffer(0.27)
+    assert is_duplicate(shape, translate(shape, xoff=0.004))
+    assert not is_duplicate(shape, translate(shape, xoff=2 * DUPLICATE_TOLERANCE_DEG))
+
+
+def test_near_duplicates_share_a_group_as_members():
+    shape = Point(-59, -2).buffer(0.27)
+    groups = group_aois({'A': shape, 'B': translate(shape, xoff=0.004)})
+
+    assert len(groups) == 1
+    assert groups[0]['name'].startswith('grupo_')
+    assert set(groups[0]['members']) == {'A', 'B'}
+    assert groups[0]['aliases'] == {}
+
+
+def test_overlapping_aois_merge_when_union_bbox_is_cheaper():
+    a = box(0, 0, 2, 2)
+    b = box(1, 0, 3, 2)  # retângulo unido (6) < soma dos retângulos (8)
+    groups = group_aois({'A': a, 'B': b})
+
+    assert len(groups) == 1
+    assert set(groups[0]['members']) == {'A', 'B'}
+
+
+def test_overlapping_aois_stay_apart_when_union_bbox_is_costlier():
+    a = box(0, 0, 10, 1)
+    b = box(9, 0, 10, 10)  # formam um "L": retângulo unido (100) > soma (20)
+    groups = group_aois({'A': a, 'B': b})
+
+    assert sorted(group['name'] for group in groups) == ['A', 'B']
+
+
+def test_disjoint_aois_stay_apart():
+    groups = group_aois({'A': box(0, 0, 1, 1), 'B': box(5, 5, 6, 6)})
+    assert sorted(group['name'] for group in groups) == ['A', 'B']
+
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(AOI_DIR, 'buffer_ATTO_30km.shp')),
+                    reason="shapefiles de exemplo ausentes")
+def test_atto_buffers_are_grouped():
+    from gee_ops import load_aoi_shape
+
+    shapes = {
+        name: load_aoi_shape(os.path.join(AOI_DIR, f"{name}.shp"))
+        for name in ['buffer_ATTO_30km', 'buffer_30km_ATTO', 'buffer_30km_K34']
+    }
+    assert is_duplicate(shapes['buffer_ATTO_30km'], shapes['buffer_30km_ATTO'])
+
+    groups = {frozenset(group['members']) for group in group_aois(shapes)}
+    assert frozenset({'buffer_ATTO_30km', 'buffer_30km_ATTO'}) in groups
+    assert frozenset({'buffer_30km_K34'}) in groups
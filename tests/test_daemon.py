@@ -0,0 +1,71 @@
+import pytest
+from shapely.geometry import box
+import daemon
+
+NDVI = 'NDVI_16Day_250m_Terra (MOD13Q1)'
+
+
+@pytest.fixture(autouse=True)
+def fake_aois(monkeypatch):
+    """Duas AOIs falsas, sem ler shapefiles do disco."""
+    monkeypatch.setattr(daemon, 'find_shapefiles', lambda: ['aoi/A.shp', 'aoi/B.shp'])
+    monkeypatch.setattr(daemon, '_load_aoi_cached', lambda path: box(0, 0, 1, 1))
+
+
+def _params(**overrides):
+    params = {'aois': ['A'], 'collections': [NDVI]}
+    params.update(overrides)
+    return params
+
+
+def test_parse_job_defaults():
+    aoi_shapes, job = daemon._parse_job(_params(aois=['A.shp', 'B']))
+
+    assert list(aoi_shapes) == ['A', 'B']
+    assert job['mode'] == 'rasters'
+    assert job['start_date'] == '2001-01-01'
+    assert job['window_pixels'] == 0
+    assert job['native_grid'] is False
+
+
+@pytest.mark.parametrize('params', [
+    ['A'],
+    _params(aois='A'),
+    _params(aois=[]),
+    _params(aois=['C']),
+    _params(aois=[1]),
+    _params(collections=NDVI),
+    _params(collections=['XYZ']),
+    _params(start_date=20200101),
+    _params(start_date='01/01/2020'),
+    _params(mode='tifs'),
+    _params(window_pixels=True),
+    _params(window_pixels=-1),
+    _params(window_pixels=1.5),
+    _params(window_pixels=daemon.MAX_WINDOW_PIXELS + 1),
+    _params(native_grid='false'),
+    _params(native_grid=0),
+])
+def test_parse_job_rejects_invalid_params(params):
+    with pytest.raises(ValueError):
+        daemon._parse_job(params)
+
+
+def test_parse_job_reports_unreadable_shapefile(monkeypatch):
+    def _missing(path):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(daemon, '_load_aoi_cached', _missing)
+
+    with pytest.raises(ValueError, match="'A'"):
+        daemon._parse_job(_params())
+
+
+def test_output_keys_conflict_only_on_same_files():
+    aoi_shapes, job = daemon._parse_job(_params(mode='sites', window_pixels=1))
+    _, other_window = daemon._parse_job(_params(mode='sites', window_pixels=2))
+    _, rasters = daemon._parse_job(_params())
+
+    keys = daemon._job_output_keys(job, aoi_shapes)
+    assert keys == daemon._job_output_keys(dict(job), aoi_shapes)
+    assert set(keys).isdisjoint(daemon._job_output_keys(other_window, aoi_shapes))
+    assert daemon._job_output_keys(rasters, aoi_shapes) == [('A', NDVI)]
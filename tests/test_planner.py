@@ -0,0 +1,74 @@
+import math
+import pytest
+from shapely.geometry import box
+from gee_ops import MODIS_COLLECTIONS
+from planner import CADENCE_DAYS, estimate_collection, get_cadence_days, plan_job
+
+NDVI = 'NDVI_16Day_250m_Terra (MOD13Q1)'
+LST_DAILY = 'LST_Day_Daily_1km_Terra (MOD11A1)'
+WATER = 'water_mask_250m_Terra (MOD44W)'
+
+FOOTPRINT = box(-60, -3, -59.5, -2.5)
+
+
+@pytest.mark.parametrize('collection_key', list(MODIS_COLLECTIONS))
+def test_every_collection_declares_a_known_cadence(collection_key):
+    assert MODIS_COLLECTIONS[collection_key].get('cadence') in CADENCE_DAYS
+
+
+@pytest.mark.parametrize('collection_key, days', [
+    (NDVI, 16),
+    ('LAI_8Day_500m_Terra (MOD15A2H)', 8),
+    (LST_DAILY, 1),
+    ('BurnedArea_Monthly_500m_Terra (MCD64A1)', 365.25 / 12),
+    ('LandCover_Type1_Yearly_500m_Terra (MCD12Q1)', 365.25),
+    (WATER, 365.25),
+])
+def test_get_cadence_days(collection_key, days):
+    assert get_cadence_days(collection_key) == days
+
+
+def test_estimate_counts_images_by_cadence():
+    estimate = estimate_collection(NDVI, FOOTPRINT, '2020-01-01', '2021-01-01')
+    assert estimate['images'] == math.ceil(366 / 16)
+
+    yearly = estimate_collection(WATER, FOOTPRINT, '2020-01-01', '2021-01-01')
+    assert yearly['images'] == 2
+
+
+def test_estimate_bytes_follow_pixels_and_bands():
+    estimate = estimate_collection(NDVI, FOOTPRINT, '2020-01-01', '2021-01-01')
+    # NDVI tem fator de escala: 1 banda em float32
+    assert estimate['bytes_total'] == estimate['images'] * estimate['pixels_per_image'] * 4
+    assert estimate['strategy']['tile_grid'] == 1
+
+
+def test_estimate_native_grid_uses_real_pixel_size():
+    epsg4326 = estimate_collection(NDVI, FOOTPRINT, '2020-01-01', '2021-01-01')
+    native = estimate_collection(NDVI, FOOTPRINT, '2020-01-01', '2021-01-01', native_grid=True)
+
+    assert native['native_grid'] and not epsg4326['native_grid']
+    # Pixel nativo (~232 m) é menor que o nominal (250 m): mais pixels por imagem
+    assert native['pixels_per_image'] > epsg4326['pixels_per_image']
+
+
+def test_estimate_large_area_is_tiled():
+    estimate = estimate_collection(NDVI, box(-70, -10, -50, 5), '2020-01-01', '2020-02-01')
+    assert estimate['strategy']['tile_grid'] > 1
+
+
+def test_estimate_more_members_cost_more_requests():
+    single = estimate_collection(LST_DAILY, FOOTPRINT, '2020-01-01', '2021-01-01')
+    grouped = estimate_collection(LST_DAILY, FOOTPRINT, '2020-01-01', '2021-01-01', n_members=3)
+    assert grouped['requests'] > single['requests']
+
+
+def test_plan_job_has_one_entry_per_group_and_collection():
+    groups = [
+        {'name': 'A', 'footprint': FOOTPRINT, 'members': {'A': FOOTPRINT}},
+        {'name': 'B', 'footprint': box(0, 0, 0.5, 0.5), 'members': {'B': box(0, 0, 0.5, 0.5)}},
+    ]
+    plan = plan_job(groups, [NDVI, WATER], '2020-01-01', '2021-01-01')
+    assert [(item['group'], item['collection']) for item in plan] == [
+        ('A', NDVI), ('A', WATER), ('B', NDVI), ('B', WATER)
+    ]
@@ -1,5 +1,6 @@
 import os
 import glob
+import pandas as pd
 from config import AOI_DIR
 
 def find_shapefiles():
@@ -12,4 +13,16 @@ def find_shapefiles():
     if not shapefiles:
         print(f"Atenção: Nenhum arquivo .shp encontrado em {AOI_DIR}")
         print("Por favor, adicione seus shapefiles de AOI nesta pasta.")
-    return shapefiles
\ No newline at end of file
+    return shapefiles
+
+
+def load_sites_csv(csv_path):
+    """
+    Lê um CSV de locais (torres) com as colunas 'site', 'lon' e 'lat' (EPSG:4326).
+    Retorna um dicionário {site: (lon, lat)}.
+    """
+    df = pd.read_csv(csv_path)
+    missing = {'site', 'lon', 'lat'} - set(df.columns)
+    if missing:
+        raise ValueError(f"Colunas ausentes em {csv_path}: {', '.join(sorted(missing))}")
+    return {str(row.site): (float(row.lon), float(row.lat)) for row in df.itertuples()}